@@ -6,17 +6,48 @@ A simple MCP server for scanning and retrieving files with privacy filtering.
 
 from mcp.server.fastmcp import FastMCP
 from pydantic import BaseModel, Field, ConfigDict
-from typing import Optional, List
+from typing import Optional, List, Tuple
 from pathlib import Path
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import fnmatch
 import json
+import os
+import re
+import sys
 from enum import Enum
 
+try:
+    import ahocorasick  # pyahocorasick: optional, used for marker matching
+except ImportError:
+    ahocorasick = None
+
+try:
+    import liburing  # python-liburing: optional, Linux-only batched reads
+except ImportError:
+    liburing = None
+
+try:
+    import orjson  # optional, C-level JSON encoding for tool responses
+except ImportError:
+    orjson = None
+
+try:
+    from _ci_search import find_ci as _find_ci_c  # optional compiled search
+except ImportError:
+    _find_ci_c = None
+
+try:
+    import stringzilla  # optional, SIMD substring search
+except ImportError:
+    stringzilla = None
+
 # Initialize MCP server
 mcp = FastMCP("file_scanner_mcp")
 
 # Configuration
 DOCUMENTS_DIR = Path(__file__).parent/"test_documents"
-print(f"Using documents directory: {DOCUMENTS_DIR}")
 
 
 class PrivacyLevel(str, Enum):
@@ -80,6 +111,10 @@ class GetFileInput(BaseModel):
         default=ResponseFormat.MARKDOWN,
         description="Output format: 'markdown' for human-readable or 'json' for machine-readable"
     )
+    pretty: bool = Field(
+        default=False,
+        description="If true, indent JSON responses; compact by default since content can be large"
+    )
 
 
 class ListFilesInput(BaseModel):
@@ -104,46 +139,611 @@ class ListFilesInput(BaseModel):
     )
 
 
-def _classify_privacy(content: str) -> PrivacyLevel:
-    """Classify document privacy level based on content markers."""
-    content_lower = content.lower()
-    
-    # Check for privacy markers in content
-    if any(marker in content_lower for marker in ["[confidential]", "ssn:", "credit card:", "password:"]):
-        return PrivacyLevel.CONFIDENTIAL
-    elif any(marker in content_lower for marker in ["[sensitive]", "internal only", "employee id:"]):
-        return PrivacyLevel.SENSITIVE
-    else:
+# Privacy markers, pre-lowercased as bytes so matching never needs a
+# lowercased copy of the file content.
+_CONFIDENTIAL_MARKERS = [b"[confidential]", b"ssn:", b"credit card:", b"password:"]
+_SENSITIVE_MARKERS = [b"[sensitive]", b"internal only", b"employee id:"]
+
+# Maps ASCII uppercase byte values to lowercase; every other byte maps to itself.
+_TO_LOWER = bytes(b + 32 if 65 <= b <= 90 else b for b in range(256))
+
+
+def _build_automaton(markers: List[bytes]) -> "ahocorasick.Automaton":
+    """Compile a marker list into an Aho-Corasick automaton."""
+    automaton = ahocorasick.Automaton()
+    for marker in markers:
+        automaton.add_word(marker.decode("ascii"), True)
+    automaton.make_automaton()
+    return automaton
+
+
+# Compiled once at import so each tier is matched in a single linear pass
+# instead of one scan per marker.
+if ahocorasick is not None:
+    _CONF_AC = _build_automaton(_CONFIDENTIAL_MARKERS)
+    _SENS_AC = _build_automaton(_SENSITIVE_MARKERS)
+else:
+    _CONF_AC = _SENS_AC = None
+
+
+def _find_ci(hay: bytes, needle_lower: bytes) -> int:
+    """Case-insensitive substring search over raw bytes.
+
+    Scans `hay` in place, folding one byte at a time: first locate a
+    position where the folded byte matches the needle's first byte, then
+    verify the rest of the needle there. No lowercased copy of `hay` is
+    ever materialized. Returns the match offset, or -1.
+
+    When the compiled _ci_search extension is available the scan runs as a
+    C loop with the GIL released; the pure-Python loop below is the
+    drop-in fallback.
+    """
+    if _find_ci_c is not None:
+        return _find_ci_c(hay, needle_lower)
+    if not needle_lower:
+        return 0
+    fold = _TO_LOWER
+    first = needle_lower[0]
+    n = len(needle_lower)
+    i = 0
+    end = len(hay) - n
+    while i <= end:
+        if fold[hay[i]] == first:
+            j = 1
+            while j < n and fold[hay[i + j]] == needle_lower[j]:
+                j += 1
+            if j == n:
+                return i
+        i += 1
+    return -1
+
+
+def _contains_ci(hay: bytes, needle_lower: bytes) -> bool:
+    """Case-insensitive substring test over raw bytes."""
+    return _find_ci(hay, needle_lower) >= 0
+
+
+def _compile_query(query: str) -> Tuple[bytes, "re.Pattern"]:
+    """Compile a search query once per call, for reuse across every file.
+
+    Returns the pre-lowercased needle (used by stringzilla and the
+    filename scan) and an escaped bytes-mode IGNORECASE regex whose
+    ASCII-only folding matches the byte scans' semantics.
+    """
+    needle_lower = query.lower().encode("utf-8")
+    pattern = re.compile(re.escape(query.encode("utf-8")), re.IGNORECASE)
+    return needle_lower, pattern
+
+
+def _find_query(content: bytes, needle_lower: bytes, pattern: "re.Pattern") -> int:
+    """Locate the query inside file content, case-insensitively.
+
+    File bodies are the large haystacks, so they go through stringzilla's
+    SIMD uncased search when it is installed (its Unicode folding agrees
+    with ASCII folding on these UTF-8 text files); otherwise the
+    precompiled query regex runs in SRE's C matcher.
+    """
+    if stringzilla is not None:
+        return stringzilla.utf8_uncased_search(content, needle_lower)
+    found = pattern.search(content)
+    return found.start() if found else -1
+
+
+def _specialize_classifier():
+    """Generate a straight-line classifier for the current marker sets.
+
+    The marker lists are import-time constants, so the generic loop's list
+    iteration and per-check global lookups can be partially evaluated away:
+    each marker becomes one hard-coded _find_ci call in a generated body,
+    with the search function and the three levels bound as locals.
+    """
+    lines = [
+        "def _classify_specialized(content, _find_ci=_find_ci,",
+        "                          _CONF=PrivacyLevel.CONFIDENTIAL,",
+        "                          _SENS=PrivacyLevel.SENSITIVE,",
+        "                          _PUB=PrivacyLevel.PUBLIC):",
+    ]
+    for marker in _CONFIDENTIAL_MARKERS:
+        lines.append(f"    if _find_ci(content, {marker!r}) >= 0:")
+        lines.append("        return _CONF")
+    for marker in _SENSITIVE_MARKERS:
+        lines.append(f"    if _find_ci(content, {marker!r}) >= 0:")
+        lines.append("        return _SENS")
+    lines.append("    return _PUB")
+
+    namespace = {"_find_ci": _find_ci, "PrivacyLevel": PrivacyLevel}
+    exec("\n".join(lines), namespace)
+    return namespace["_classify_specialized"]
+
+
+_CLASSIFY_SPECIALIZED = _specialize_classifier()
+
+
+def _classify_privacy_bytes(content: bytes) -> PrivacyLevel:
+    """Classify document privacy level based on content markers.
+
+    Confidential markers are checked first and the function returns as soon
+    as one is found, so the sensitive tier is only ever scanned for content
+    that carries no confidential marker.
+    """
+    if _CONF_AC is not None:
+        # pyahocorasick matches on str: bytes.lower() is a single C-level
+        # ASCII fold and latin-1 decodes byte-for-byte, so all markers
+        # (pure ASCII) match at the same positions as in the raw bytes.
+        text = content.lower().decode("latin-1")
+        for _ in _CONF_AC.iter(text):
+            return PrivacyLevel.CONFIDENTIAL
+        for _ in _SENS_AC.iter(text):
+            return PrivacyLevel.SENSITIVE
         return PrivacyLevel.PUBLIC
 
+    return _CLASSIFY_SPECIALIZED(content)
+
+
+# The tool handlers are `async def` because FastMCP requires that
+# signature, but each MCP request already runs on its own task and every
+# handler just blocks on local file syscalls. All I/O below is therefore
+# deliberately synchronous — no asyncio.to_thread hops or async file
+# wrappers, which would only add coroutine scheduling overhead here.
+_READ_BUF = 4096
+
+# Cache of file contents and classification keyed by path. Each entry is
+# (st_mtime_ns, st_size, content, privacy_level); entries are reused as long
+# as the file's mtime and size are unchanged, so repeat tool calls skip both
+# disk I/O and privacy re-classification.
+_FILE_CACHE: "OrderedDict[Path, Tuple[int, int, bytes, PrivacyLevel]]" = OrderedDict()
+_FILE_CACHE_MAX = 256
+_CACHE_LOCK = threading.Lock()
+
+# Shared pool for per-file scan work: files are independent, the hot
+# byte-search and decode primitives run in C, and reads block in syscalls,
+# so a directory scan parallelizes cleanly across workers.
+_EXEC = ThreadPoolExecutor(max_workers=min(32, (os.cpu_count() or 1) * 4))
+
+# Rendered-response caches for the two scanning tools, keyed on the request
+# parameters plus the directory's mtime_ns. Agent callers retry identical
+# requests constantly; a hit returns the finished response with no I/O
+# beyond one stat, and any directory change rolls the key over.
+_RESULT_CACHE_MAX = 128
+_SEARCH_CACHE: "OrderedDict[tuple, str]" = OrderedDict()
+_LIST_CACHE: "OrderedDict[tuple, str]" = OrderedDict()
+
+
+# Filename byte table for the documents directory, as
+# (dir_mtime_ns, {filename: utf-8 bytes}). The query needle is already
+# lowercased and the searches case-fold, so the encoded name is all a
+# match needs; caching it saves one encode per file per search.
+_NAME_TABLE: Optional[Tuple[int, dict]] = None
+
+
+def _get_name_table(entries: List[os.DirEntry], dir_mtime_ns: int) -> dict:
+    """Map filename to its UTF-8 bytes for the current directory state."""
+    global _NAME_TABLE
+    if _NAME_TABLE is not None and _NAME_TABLE[0] == dir_mtime_ns:
+        return _NAME_TABLE[1]
+    table = {entry.name: entry.name.encode("utf-8") for entry in entries}
+    _NAME_TABLE = (dir_mtime_ns, table)
+    return table
+
+
+def _dir_content_state(entries: List[os.DirEntry]) -> int:
+    """Newest file mtime_ns across the scan set, for cache keying.
+
+    The directory's own mtime only moves on membership changes; in-place
+    edits bump the file mtime instead, and the DirEntry stats from the
+    scandir pass make checking them free.
+    """
+    state = 0
+    for entry in entries:
+        try:
+            mtime_ns = entry.stat(follow_symlinks=False).st_mtime_ns
+        except OSError:
+            continue
+        if mtime_ns > state:
+            state = mtime_ns
+    return state
+
+
+def _cached_response(cache: "OrderedDict[tuple, str]", key: tuple) -> Optional[str]:
+    """Return the cached response for key, refreshing its LRU slot."""
+    response = cache.get(key)
+    if response is not None:
+        cache.move_to_end(key)
+    return response
+
+
+def _store_response(cache: "OrderedDict[tuple, str]", key: tuple, response: str) -> str:
+    """Cache a rendered response under key and return it."""
+    cache[key] = response
+    while len(cache) > _RESULT_CACHE_MAX:
+        cache.popitem(last=False)
+    return response
+
+
+def _load(filepath: Path) -> Tuple[bytes, PrivacyLevel, int]:
+    """Load a file's raw content, privacy level and size.
+
+    Results are cached in an LRU keyed on (mtime_ns, size) so unchanged
+    files are read and classified only once across tool calls.
+    """
+    st = os.stat(filepath)
+    with _CACHE_LOCK:
+        cached = _FILE_CACHE.get(filepath)
+        if cached is not None and cached[0] == st.st_mtime_ns and cached[1] == st.st_size:
+            _FILE_CACHE.move_to_end(filepath)
+            return cached[2], cached[3], cached[1]
+
+    # Raw binary read: no codec state machine, and decoding is deferred to
+    # the one caller that actually returns text.
+    with filepath.open("rb", buffering=_READ_BUF) as f:
+        content = f.read()
+    privacy_level = _classify_privacy_bytes(content)
+
+    with _CACHE_LOCK:
+        _FILE_CACHE[filepath] = (st.st_mtime_ns, st.st_size, content, privacy_level)
+        _FILE_CACHE.move_to_end(filepath)
+        while len(_FILE_CACHE) > _FILE_CACHE_MAX:
+            _FILE_CACHE.popitem(last=False)
+
+    return content, privacy_level, st.st_size
+
+
+# Submission queue depth for the shared io_uring; directory scans larger
+# than this are submitted in chunks.
+_URING_DEPTH = 64
+_URING = None
+
+# Flipped after any ring-level failure (EPERM from seccomp policies,
+# ENOMEM from RLIMIT_MEMLOCK, ...) so every later scan goes straight to
+# the sequential _load path instead of re-hitting the same error.
+_URING_DISABLED = False
+
+# Fixed read arena: one slot per queue entry (64 x 32 KiB = 2 MiB),
+# registered with the kernel once so reads into it skip the per-I/O page
+# pinning. Files larger than a slot use a plain heap buffer instead.
+_URING_BUF_SIZE = 32 * 1024
+_URING_BUFS: Optional[List[bytearray]] = None
+_URING_IOVECS = None  # keeps the registered iovec array alive
+
+# Registered fds for the hot documents directory: Path -> (index, fd, inode).
+# The whole set is re-registered whenever the directory's membership or any
+# inode changes; in-place edits keep their fd valid and need no churn.
+_REG_FILES: dict = {}
+_REG_FILE_IDS = None  # keeps the FileIndex array alive
+
+# File/buffer registration needs the io_uring feature set of Linux >= 5.6
+# (IORING_OP_READ and updatable file tables).
+_URING_REGISTER_OK = (
+    liburing is not None
+    and sys.platform == "linux"
+    and not liburing.linux_version_check(5.6)
+)
+
+
+def _get_uring() -> "liburing.Ring":
+    """Return the shared io_uring, initializing it on first use."""
+    global _URING
+    if _URING is None:
+        ring = liburing.Ring()
+        liburing.io_uring_queue_init(_URING_DEPTH, ring)
+        _URING = ring
+    return _URING
+
+
+def _ensure_buffers_registered(ring: "liburing.Ring") -> None:
+    """Register the fixed read arena on first use."""
+    global _URING_BUFS, _URING_IOVECS
+    if _URING_BUFS is not None or not _URING_REGISTER_OK:
+        return
+    bufs = [bytearray(_URING_BUF_SIZE) for _ in range(_URING_DEPTH)]
+    try:
+        iovecs = liburing.Iovec(bufs)
+        liburing.io_uring_register_buffers(ring, iovecs)
+    except OSError:
+        return
+    _URING_BUFS = bufs
+    _URING_IOVECS = iovecs
+
+
+def _ensure_files_registered(ring: "liburing.Ring", stats: List[Tuple[Path, os.stat_result]]) -> None:
+    """(Re)register the scan set's file descriptors with the ring.
+
+    Registered files skip the kernel's per-operation fget/fput, which pays
+    off when the same documents directory is scanned over and over. The
+    registration is dropped and rebuilt whenever a file appears, vanishes,
+    or is replaced (inode change); plain in-place modifications keep the
+    registered fd valid.
+    """
+    global _REG_FILES, _REG_FILE_IDS
+    if not _URING_REGISTER_OK or len(stats) > _URING_DEPTH:
+        return
+    fresh = {filepath: st.st_ino for filepath, st in stats}
+    if _REG_FILES and fresh == {p: ino for p, (_, _, ino) in _REG_FILES.items()}:
+        return
+
+    if _REG_FILES:
+        try:
+            liburing.io_uring_unregister_files(ring)
+        except OSError:
+            pass
+        for _, fd, _ in _REG_FILES.values():
+            os.close(fd)
+        _REG_FILES = {}
+        _REG_FILE_IDS = None
+
+    registered = {}
+    fds = []
+    for filepath, st in stats:
+        try:
+            fd = os.open(filepath, os.O_RDONLY)
+        except OSError:
+            continue
+        registered[filepath] = (len(fds), fd, st.st_ino)
+        fds.append(fd)
+    if not fds:
+        return
+    try:
+        file_ids = liburing.FileIndex(fds)
+        liburing.io_uring_register_files(ring, file_ids)
+    except OSError:
+        for fd in fds:
+            os.close(fd)
+        return
+    _REG_FILES = registered
+    _REG_FILE_IDS = file_ids
+
+
+def _uring_read_batch(batch: List[Tuple[Path, os.stat_result]]) -> None:
+    """Read one batch of files through io_uring and fill _FILE_CACHE.
+
+    Queues one read SQE per file and submits them all with a single
+    io_uring_enter, so syscall and device latency are amortized across the
+    batch instead of accumulating one blocking pread per file. Files whose
+    read fails or comes back short are left uncached for _load's
+    sequential path to retry and report.
+    """
+    ring = _get_uring()
+    _ensure_buffers_registered(ring)
+    opened_fds, bufs, submitted = [], [], []
+    try:
+        for filepath, st in batch:
+            registration = _REG_FILES.get(filepath)
+            fixed_file = registration is not None and registration[2] == st.st_ino
+            if fixed_file:
+                fd = registration[0]
+            else:
+                try:
+                    fd = os.open(filepath, os.O_RDONLY)
+                except OSError:
+                    continue
+                opened_fds.append(fd)
+
+            slot = len(submitted)
+            fixed_buf = _URING_BUFS is not None and st.st_size <= _URING_BUF_SIZE
+            buf = _URING_BUFS[slot] if fixed_buf else bytearray(st.st_size)
+
+            sqe = liburing.io_uring_get_sqe(ring)
+            if fixed_buf:
+                liburing.io_uring_prep_read_fixed(sqe, fd, buf, slot, offset=0)
+            else:
+                liburing.io_uring_prep_read(sqe, fd, buf, offset=0)
+            if fixed_file:
+                liburing.io_uring_sqe_set_flags(sqe, liburing.IOSQE_FIXED_FILE)
+            sqe.user_data = slot
+            bufs.append(buf)
+            submitted.append((filepath, st))
+        if not submitted:
+            return
+
+        liburing.io_uring_submit_and_wait(ring, len(submitted))
+        cqe = liburing.Cqe()
+        reaped = 0
+        while reaped < len(submitted):
+            liburing.io_uring_wait_cqe(ring, cqe)
+            ready = liburing.io_uring_cq_ready(ring)
+            for i in range(ready):
+                entry = cqe[i]
+                filepath, st = submitted[entry.user_data]
+                if entry.res == st.st_size:
+                    # Fixed-arena slots are slot-sized; trim to the file.
+                    content = bytes(memoryview(bufs[entry.user_data])[:st.st_size])
+                    with _CACHE_LOCK:
+                        _FILE_CACHE[filepath] = (
+                            st.st_mtime_ns, st.st_size, content,
+                            _classify_privacy_bytes(content)
+                        )
+                        _FILE_CACHE.move_to_end(filepath)
+            liburing.io_uring_cq_advance(ring, ready)
+            reaped += ready
+        with _CACHE_LOCK:
+            while len(_FILE_CACHE) > _FILE_CACHE_MAX:
+                _FILE_CACHE.popitem(last=False)
+    finally:
+        for fd in opened_fds:
+            os.close(fd)
+
+
+def _preload_files(filepaths: List[Path]) -> None:
+    """Warm _FILE_CACHE for a directory scan with batched io_uring reads.
+
+    Stats each file, skips entries the cache already covers, and submits
+    the remainder in depth-sized batches. The preload is purely an
+    optimization over _load: without liburing (non-Linux or package
+    absent) it is a no-op, and any ring-level failure — setup, submission
+    or registration — disables the uring for the rest of the process
+    rather than surfacing an error for a scan _load can serve.
+    """
+    global _URING_DISABLED
+    if liburing is None or _URING_DISABLED:
+        return
+    stats = []
+    pending = []
+    for filepath in filepaths:
+        try:
+            st = os.stat(filepath)
+        except OSError:
+            continue
+        stats.append((filepath, st))
+        with _CACHE_LOCK:
+            cached = _FILE_CACHE.get(filepath)
+        if cached is not None and cached[0] == st.st_mtime_ns and cached[1] == st.st_size:
+            continue
+        pending.append((filepath, st))
+    try:
+        _ensure_files_registered(_get_uring(), stats)
+        for start in range(0, len(pending), _URING_DEPTH):
+            _uring_read_batch(pending[start:start + _URING_DEPTH])
+    except OSError:
+        _URING_DISABLED = True
+
+
+# Privacy markers sit in document headers in practice, so this much of the
+# file is usually enough to decide the level.
+_CLASSIFY_PREFIX_BYTES = 8192
+
+
+def _classify_privacy_from_prefix(filepath: Path, st: Optional[os.stat_result] = None) -> PrivacyLevel:
+    """Classify a file from its leading bytes without a full read.
+
+    Reads only the first _CLASSIFY_PREFIX_BYTES (reusing the cache when the
+    full content is already loaded). Only a confidential prefix hit is
+    final — anything weaker can still be upgraded by a marker later in the
+    file — so larger files re-check in full unless the prefix already
+    proved CONFIDENTIAL.
+    """
+    if st is None:
+        st = os.stat(filepath)
+    with _CACHE_LOCK:
+        cached = _FILE_CACHE.get(filepath)
+        if cached is not None and cached[0] == st.st_mtime_ns and cached[1] == st.st_size:
+            return cached[3]
+
+    with filepath.open("rb", buffering=_READ_BUF) as f:
+        head = f.read(_CLASSIFY_PREFIX_BYTES)
+    level = _classify_privacy_bytes(head)
+    if level != PrivacyLevel.CONFIDENTIAL and st.st_size > _CLASSIFY_PREFIX_BYTES:
+        return _load(filepath)[1]
+    return level
+
+
+def _encode(obj: dict, pretty: bool = True) -> str:
+    """Encode a tool response as JSON, indented unless pretty is off.
+
+    Uses orjson's single-pass C encoder when available; the stdlib result
+    is byte-for-byte equivalent, just slower. Compact encoding matters for
+    large file payloads, where indent=2 re-walks the whole body line by
+    line for no machine-readable benefit.
+    """
+    if orjson is not None:
+        option = orjson.OPT_INDENT_2 if pretty else 0
+        return orjson.dumps(obj, option=option).decode()
+    if pretty:
+        return json.dumps(obj, indent=2)
+    return json.dumps(obj, separators=(",", ":"))
+
+
+def _scan_directory(pattern: Optional[str] = None) -> List[os.DirEntry]:
+    """List regular files in DOCUMENTS_DIR with a single scandir pass.
+
+    DirEntry objects carry the stat data gathered during the directory
+    read, so callers avoid issuing a second stat per file. Without a
+    pattern the default '*.txt' filter is a plain suffix check; custom
+    patterns go through fnmatch. Hidden files are skipped unless the
+    pattern asks for them, matching Path.glob semantics.
+    """
+    entries = []
+    with os.scandir(DOCUMENTS_DIR) as it:
+        for entry in it:
+            name = entry.name
+            if name.startswith('.') and not (pattern and pattern.startswith('.')):
+                continue
+            if pattern is None:
+                if not name.endswith('.txt'):
+                    continue
+            elif not fnmatch.fnmatchcase(name, pattern):
+                continue
+            if not entry.is_file(follow_symlinks=False):
+                continue
+            entries.append(entry)
+    return entries
+
+
+def _get_file_metadata(entry: "os.DirEntry | Path", content: Optional[bytes] = None) -> dict:
+    """Get metadata for a file; never loads more than the classify prefix.
+
+    A DirEntry caller reuses the stat cached from the directory read, so
+    no extra syscall is issued; a Path caller pays one fresh stat. Callers
+    that already hold the file's content pass it in and skip the prefix
+    read entirely.
+    """
+    if isinstance(entry, os.DirEntry):
+        filepath = Path(entry.path)
+        st = entry.stat(follow_symlinks=False)
+    else:
+        filepath = entry
+        st = os.stat(filepath)
+
+    if content is not None:
+        privacy_level = _classify_privacy_bytes(content)
+    else:
+        privacy_level = _classify_privacy_from_prefix(filepath, st)
 
-def _get_file_metadata(filepath: Path) -> dict:
-    """Get metadata for a file."""
-    content = filepath.read_text()
     return {
         "filename": filepath.name,
-        "size_bytes": filepath.stat().st_size,
-        "privacy_level": _classify_privacy(content).value,
+        "size_bytes": st.st_size,
+        "privacy_level": privacy_level.value,
         "path": str(filepath)
     }
 
 
+def _match_file(entry: os.DirEntry, query_needle: bytes, query_re: "re.Pattern",
+                exclude_sensitive: bool, name_table: dict) -> Optional[dict]:
+    """Read, classify and query-match a single file for search_files.
+
+    Returns the match dict, or None when the file is filtered out, does
+    not match, or cannot be read. Runs on _EXEC workers, one per file.
+    """
+    try:
+        content, privacy_level, size_bytes = _load(Path(entry.path))
+    except Exception:
+        return None
+
+    if exclude_sensitive and privacy_level != PrivacyLevel.PUBLIC:
+        return None
+
+    # Each of name and content is searched at most once and the position
+    # decides match_type.
+    name_bytes = name_table.get(entry.name) or entry.name.encode("utf-8")
+    name_pos = _find_ci(name_bytes, query_needle)
+    content_pos = _find_query(content, query_needle, query_re) if name_pos < 0 else -1
+    if name_pos < 0 and content_pos < 0:
+        return None
+
+    return {
+        "filename": entry.name,
+        "privacy_level": privacy_level.value,
+        "size_bytes": size_bytes,
+        "match_type": "filename" if name_pos >= 0 else "content"
+    }
+
+
 def _format_file_list(files_metadata: List[dict], format_type: ResponseFormat) -> str:
     """Format file list as markdown or JSON."""
     if format_type == ResponseFormat.JSON:
-        return json.dumps({"files": files_metadata, "count": len(files_metadata)}, indent=2)
+        return _encode({"files": files_metadata, "count": len(files_metadata)})
     
     # Markdown format
     if not files_metadata:
         return "No files found."
-    
-    result = f"# Found {len(files_metadata)} file(s)\n\n"
+
+    # Accumulate parts and join once: no intermediate strings per file.
+    parts = [f"# Found {len(files_metadata)} file(s)\n\n"]
     for file_meta in files_metadata:
-        result += f"## {file_meta['filename']}\n"
-        result += f"- **Privacy Level**: {file_meta['privacy_level']}\n"
-        result += f"- **Size**: {file_meta['size_bytes']} bytes\n\n"
-    
-    return result
+        parts.append(f"## {file_meta['filename']}\n")
+        parts.append(f"- **Privacy Level**: {file_meta['privacy_level']}\n")
+        parts.append(f"- **Size**: {file_meta['size_bytes']} bytes\n\n")
+
+    return "".join(parts)
 
 
 @mcp.tool(
@@ -174,34 +774,69 @@ async def search_files(params: SearchFilesInput) -> str:
     """
     try:
         if not DOCUMENTS_DIR.exists():
-            return json.dumps({"error": "Documents directory not found", "files": []}, indent=2)
+            return _encode({"error": "Documents directory not found", "files": []})
         
+        dir_mtime_ns = DOCUMENTS_DIR.stat().st_mtime_ns
+        entries = _scan_directory()
+        # Raw query (the response embeds it verbatim), plus both the
+        # directory mtime (membership changes) and the newest file mtime
+        # (in-place edits) so stale results are never served.
+        cache_key = (
+            params.query, params.exclude_sensitive, params.limit,
+            dir_mtime_ns, _dir_content_state(entries)
+        )
+        cached = _cached_response(_SEARCH_CACHE, cache_key)
+        if cached is not None:
+            return cached
+
         matches = []
-        query_lower = params.query.lower()
-        
-        for filepath in DOCUMENTS_DIR.glob("*.txt"):
+        query_needle, query_re = _compile_query(params.query)
+
+        name_table = _get_name_table(entries, dir_mtime_ns)
+
+        # Pass 1: filename hits need no content read at all — privacy comes
+        # from the classify prefix and the size from the DirEntry stat.
+        name_hits = []
+        remaining = []
+        for entry in entries:
+            name_bytes = name_table.get(entry.name) or entry.name.encode("utf-8")
+            if _find_ci(name_bytes, query_needle) >= 0:
+                name_hits.append(entry)
+            else:
+                remaining.append(entry)
+
+        for entry in name_hits:
             try:
-                content = filepath.read_text()
-                privacy_level = _classify_privacy(content)
-                
-                # Apply privacy filter
-                if params.exclude_sensitive and privacy_level != PrivacyLevel.PUBLIC:
-                    continue
-                
-                # Check if query matches filename or content
-                if query_lower in filepath.name.lower() or query_lower in content.lower():
-                    matches.append({
-                        "filename": filepath.name,
-                        "privacy_level": privacy_level.value,
-                        "size_bytes": filepath.stat().st_size,
-                        "match_type": "filename" if query_lower in filepath.name.lower() else "content"
-                    })
-                    
-                    if len(matches) >= params.limit:
-                        break
-                        
-            except Exception as e:
+                st = entry.stat(follow_symlinks=False)
+                privacy_level = _classify_privacy_from_prefix(Path(entry.path), st)
+            except Exception:
+                continue
+            if params.exclude_sensitive and privacy_level != PrivacyLevel.PUBLIC:
                 continue
+            matches.append({
+                "filename": entry.name,
+                "privacy_level": privacy_level.value,
+                "size_bytes": st.st_size,
+                "match_type": "filename"
+            })
+            if len(matches) >= params.limit:
+                break
+
+        # Pass 2: content search, but only for files the name test missed
+        # and only while the limit is unfilled. One worker per file; map
+        # preserves directory order so the cutoff stays deterministic.
+        if len(matches) < params.limit:
+            _preload_files([Path(entry.path) for entry in remaining])
+            for match in _EXEC.map(
+                lambda entry: _match_file(entry, query_needle, query_re,
+                                          params.exclude_sensitive, name_table),
+                remaining
+            ):
+                if match is None:
+                    continue
+                matches.append(match)
+                if len(matches) >= params.limit:
+                    break
         
         result = {
             "query": params.query,
@@ -209,11 +844,11 @@ async def search_files(params: SearchFilesInput) -> str:
             "excluded_sensitive": params.exclude_sensitive,
             "files": matches
         }
-        
-        return json.dumps(result, indent=2)
+
+        return _store_response(_SEARCH_CACHE, cache_key, _encode(result))
         
     except Exception as e:
-        return json.dumps({"error": f"Search failed: {str(e)}", "files": []}, indent=2)
+        return _encode({"error": f"Search failed: {str(e)}", "files": []})
 
 
 @mcp.tool(
@@ -247,35 +882,38 @@ async def get_file_content(params: GetFileInput) -> str:
         if not filepath.exists():
             error_msg = f"File '{params.filename}' not found in documents directory"
             if params.response_format == ResponseFormat.JSON:
-                return json.dumps({"error": error_msg, "content": None}, indent=2)
+                return _encode({"error": error_msg, "content": None}, pretty=params.pretty)
             return f"**Error**: {error_msg}"
         
-        content = filepath.read_text()
-        
+        raw, _, _ = _load(filepath)
+        content = raw.decode("utf-8")
+
         if params.response_format == ResponseFormat.JSON:
             result = {"filename": params.filename, "content": content}
             if params.include_metadata:
-                metadata = _get_file_metadata(filepath)
+                metadata = _get_file_metadata(filepath, raw)
                 result["metadata"] = metadata
-            return json.dumps(result, indent=2)
+            return _encode(result, pretty=params.pretty)
         
         # Markdown format
-        result = f"# {params.filename}\n\n"
-        
+        header = f"# {params.filename}\n\n"
+
         if params.include_metadata:
-            metadata = _get_file_metadata(filepath)
-            result += f"**Privacy Level**: {metadata['privacy_level']}  \n"
-            result += f"**Size**: {metadata['size_bytes']} bytes\n\n"
-            result += "---\n\n"
-        
-        result += content
-        
-        return result
+            metadata = _get_file_metadata(filepath, raw)
+            header = "".join([
+                header,
+                f"**Privacy Level**: {metadata['privacy_level']}  \n",
+                f"**Size**: {metadata['size_bytes']} bytes\n\n",
+                "---\n\n"
+            ])
+
+        # Two-string concat appends the (possibly large) content in one copy.
+        return header + content
         
     except Exception as e:
         error_msg = f"Failed to read file: {str(e)}"
         if params.response_format == ResponseFormat.JSON:
-            return json.dumps({"error": error_msg, "content": None}, indent=2)
+            return _encode({"error": error_msg, "content": None}, pretty=params.pretty)
         return f"**Error**: {error_msg}"
 
 
@@ -309,30 +947,39 @@ async def list_files(params: ListFilesInput) -> str:
             # DOCUMENTS_DIR.mkdir(parents=True)
             return _format_file_list([], params.response_format)
         
-        # Determine glob pattern
-        glob_pattern = params.pattern if params.pattern else "*.txt"
-        
+        entries = _scan_directory(params.pattern)
+        cache_key = (
+            params.pattern, params.privacy_filter, params.response_format,
+            DOCUMENTS_DIR.stat().st_mtime_ns, _dir_content_state(entries)
+        )
+        cached = _cached_response(_LIST_CACHE, cache_key)
+        if cached is not None:
+            return cached
+        _preload_files([Path(entry.path) for entry in entries])
+
         files_metadata = []
-        for filepath in DOCUMENTS_DIR.glob(glob_pattern):
-            if filepath.is_file():
-                metadata = _get_file_metadata(filepath)
-                
-                # Apply privacy filter if specified
-                if params.privacy_filter and metadata["privacy_level"] != params.privacy_filter.value:
-                    continue
-                
-                files_metadata.append(metadata)
+        for metadata in _EXEC.map(_get_file_metadata, entries):
+
+            # Apply privacy filter if specified
+            if params.privacy_filter and metadata["privacy_level"] != params.privacy_filter.value:
+                continue
+
+            files_metadata.append(metadata)
         
-        return _format_file_list(files_metadata, params.response_format)
+        return _store_response(
+            _LIST_CACHE, cache_key,
+            _format_file_list(files_metadata, params.response_format)
+        )
         
     except Exception as e:
         error_msg = f"Failed to list files: {str(e)}"
         if params.response_format == ResponseFormat.JSON:
-            return json.dumps({"error": error_msg, "files": []}, indent=2)
+            return _encode({"error": error_msg, "files": []})
         return f"**Error**: {error_msg}"
 
 
 if __name__ == "__main__":
     # Run with stdio transport (default for local tools)
+    print(f"Using documents directory: {DOCUMENTS_DIR}")
     print("Starting File Scanner MCP Server...")
     mcp.run()
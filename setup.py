@@ -0,0 +1,14 @@
+#!/usr/bin/env python3
+"""
+Builds the optional _ci_search extension (python setup.py build_ext --inplace).
+The server runs fine without it; file_scanner_mcp falls back to the pure-Python
+search when the compiled module is absent.
+"""
+
+from setuptools import setup
+from Cython.Build import cythonize
+
+setup(
+    name="privacy-scanner-ci-search",
+    ext_modules=cythonize("_ci_search.pyx"),
+)